@@ -1,10 +1,15 @@
 # import time
 import warnings
+from functools import partial
 
 import cvxpy as cp
 import numpy as np
+from numpy.linalg import LinAlgError
+from scipy import sparse
 from scipy.linalg import cho_factor
 from scipy.linalg import cho_solve
+from scipy.linalg import LinAlgWarning
+from scipy.linalg import solve
 from sklearn.exceptions import ConvergenceWarning
 
 from ..utils import get_prox
@@ -102,6 +107,8 @@ class TrappingSR3(SR3):
 
     accel : bool, optional (default False)
         Whether or not to use accelerated prox-gradient descent for (m, A).
+        The momentum on m is restarted whenever an update reverses
+        direction.
 
     m0 : np.ndarray, shape (n_targets), optional (default None)
         Initial guess for vector m in the optimization. Otherwise
@@ -262,10 +269,6 @@ class TrappingSR3(SR3):
         self.thresholder = thresholder
         self.reg = get_regularization(thresholder)
         self.prox = get_prox(thresholder)
-        self.A_history_ = []
-        self.m_history_ = []
-        self.PW_history_ = []
-        self.PWeigs_history_ = []
         self.history_ = []
         self.objective_history = objective_history
         self.unbias = False
@@ -325,29 +328,49 @@ class TrappingSR3(SR3):
         if (np.any(self.PL != 0.0) or np.any(self.PQ != 0.0)) and n_features != N:
             raise ValueError("Feature library is wrong shape or not quadratic")
 
-    def _update_coef_constraints(self, H, x_transpose_y, P_transpose_A, coef_sparse):
-        g = x_transpose_y + P_transpose_A / self.eta
-        inv1 = np.linalg.pinv(H, rcond=1e-15)
-        inv2 = np.linalg.pinv(
-            self.constraint_lhs.dot(inv1).dot(self.constraint_lhs.T), rcond=1e-15
-        )
-
-        rhs = g.flatten() + self.constraint_lhs.T.dot(inv2).dot(
-            self.constraint_rhs - self.constraint_lhs.dot(inv1).dot(g.flatten())
-        )
-        rhs = rhs.reshape(g.shape)
-        return inv1.dot(rhs)
-
-    def _update_A(self, A_old, PW):
-        """Update the symmetrized A matrix"""
-        eigvals, eigvecs = np.linalg.eigh(A_old)
+    def _set_Ptensors(self, r):
+        """Cache the static reshapes of the P tensors used in every iteration"""
+        # PQ has only O(1) nonzeros per quadratic term, but CSR mat-vecs carry
+        # enough overhead that dense products stay faster for small systems
+        # (about 4x at r = 3); the two break even around r = 6.
+        as_matrix = sparse.csr_matrix if r >= 6 else np.asarray
+        # PQ contracted with w over its last two axes
+        self._PQ_flat = as_matrix(self.PQ.reshape(r ** 3, -1))
+        # PQ contracted with m over its first axis, acting on m from the right
+        self._PQ_m = as_matrix(self.PQ.reshape(r, -1).T)
+        # Without PQ, P = PL does not depend on m at all
+        self._PQ_is_zero = not np.any(self.PQ)
+
+    def _update_coef_constraints(self, H_factors, g):
+        H_solve, inv1_CT, schur = H_factors
+        inv1_g = H_solve(g)
+        # The Schur complement C H^{-1} C^T is symmetric positive definite
+        # when the constraints are independent. Redundant constraints make
+        # it (near) singular, in which case keep using the pseudoinverse.
+        residual = self.constraint_rhs - self._constraint_lhs_csr @ inv1_g
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("error", LinAlgWarning)
+                lagrange = solve(schur, residual, assume_a="pos")
+        except (LinAlgError, LinAlgWarning):
+            lagrange = np.linalg.pinv(schur, rcond=1e-15).dot(residual)
+
+        return inv1_g + inv1_CT.dot(lagrange)
+
+    def _update_A(self, A_old, PW, step_is_PW=False):
+        """
+        Update the symmetrized A matrix. Pass ``step_is_PW=True`` when
+        ``A_old`` equals ``PW`` so that its spectrum is not recomputed.
+        """
         eigPW, eigvecsPW = np.linalg.eigh(PW)
-        r = A_old.shape[0]
-        A = np.diag(eigvals)
-        for i in range(r):
-            if eigvals[i] > self.gamma:
-                A[i, i] = self.gamma
-        return eigvecsPW @ A @ np.linalg.inv(eigvecsPW)
+        # Only the spectrum of A_old is needed
+        if step_is_PW:
+            eigvals = eigPW
+        else:
+            eigvals = np.linalg.eigvalsh(A_old)
+        # eigvecsPW is orthogonal, so its inverse is its transpose
+        A = np.minimum(eigvals, self.gamma)
+        return (eigvecsPW * A) @ eigvecsPW.T
 
     def _convergence_criterion(self):
         """Calculate the convergence criterion for the optimization over w"""
@@ -366,23 +389,37 @@ class TrappingSR3(SR3):
     def _objective(self, x, y, coef_sparse, A, PW, q):
         """Objective function"""
 
-        # Compute the errors
-        R2 = (y - np.dot(x, coef_sparse)) ** 2
-        A2 = (A - PW) ** 2
-        L1 = self.threshold * np.sum(np.abs(coef_sparse.flatten()))
+        # Compute each term once; they are reused for printing
+        R2 = 0.5 * np.sum((y - np.dot(x, coef_sparse)) ** 2)
+        A2 = 0.5 * np.sum((A - PW) ** 2) / self.eta
+        L1 = self.threshold * np.sum(np.abs(coef_sparse))
 
         # convoluted way to print every max_iter / 10 iterations
         if q % max(int(self.max_iter / 10.0), 1) == 0 or self.threshold != 0.0:
-            row = [q, 0.5 * np.sum(R2), 0.5 * np.sum(A2) / self.eta, L1]
+            row = [q, R2, A2, L1]
             print("{0:12d} {1:12.5e} {2:12.5e} {3:12.5e}".format(*row))
-        return 0.5 * np.sum(R2) + 0.5 * np.sum(A2) / self.eta + L1
+        return R2 + A2 + L1
 
-    def _solve_sparse_relax_and_split(self, r, N, x_expanded, y, Pmatrix, A, coef_prev):
+    def _setup_sparse_relax_and_split(self, r, N, x_expanded, y):
+        """
+        Build the CVXPY problem over xi once per fit. Only m and A change
+        between iterations, so they are the only parameters and the problem
+        is only canonicalized on the first solve.
+        """
         xi = cp.Variable(N * r)
+        m = cp.Parameter(r)
+        A = cp.Parameter(r * r)
         cost = cp.sum_squares(
             x_expanded @ xi - y.flatten()
         ) + self.threshold * cp.norm1(xi)
-        cost = cost + cp.sum_squares(Pmatrix @ xi - A.flatten()) / self.eta
+        # P = PL - sum_a m_a PQ_a. Making all of P a parameter would blow up
+        # the size of the parametrized problem (r^3 N entries), so only m is.
+        Pxi = sparse.csr_matrix(self.PL.reshape(r * r, N * r)) @ xi
+        if not self._PQ_is_zero:
+            for a in range(r):
+                PQ_a = sparse.csr_matrix(self.PQ[a].reshape(r * r, N * r))
+                Pxi = Pxi - m[a] * (PQ_a @ xi)
+        cost = cost + cp.sum_squares(Pxi - A) / self.eta
         if self.use_constraints:
             if self.inequality_constraints:
                 prob = cp.Problem(
@@ -396,9 +433,18 @@ class TrappingSR3(SR3):
                 )
         else:
             prob = cp.Problem(cp.Minimize(cost))
+        return prob, xi, m, A
 
-        # default solver is OSQP here
-        prob.solve(eps_abs=self.eps_solver, eps_rel=self.eps_solver)
+    def _solve_sparse_relax_and_split(self, prob_xi, m, A, coef_prev):
+        prob, xi, m_param, A_param = prob_xi
+        m_param.value = m
+        A_param.value = A.flatten()
+
+        # default solver is OSQP here. warm_start=True is CVXPY's default; it
+        # only pays off because prob_xi is the same problem object for the
+        # whole fit, so CVXPY keeps the OSQP workspace and restarts from the
+        # previous iterate's solution
+        prob.solve(eps_abs=self.eps_solver, eps_rel=self.eps_solver, warm_start=True)
 
         if xi.value is None:
             warnings.warn(
@@ -409,42 +455,74 @@ class TrappingSR3(SR3):
         coef_sparse = (xi.value).reshape(coef_prev.shape)
         return coef_sparse
 
-    def _solve_m_relax_and_split(self, r, N, m_prev, m, A, coef_sparse, tk_previous):
+    def _solve_m_relax_and_split(self, r, N, m_prev, m, A, coef_sparse, p, tk_previous):
         # prox-grad for (A, m)
         # Accelerated prox gradient descent
-        if self.accel:
+        if self.accel and not self._PQ_is_zero:
             tk = (1 + np.sqrt(1 + 4 * tk_previous ** 2)) / 2.0
             m_partial = m + (tk_previous - 1.0) / tk * (m - m_prev)
             tk_previous = tk
-            mPQ = np.tensordot(m_partial, self.PQ, axes=([0], [0]))
-        else:
-            mPQ = np.tensordot(m, self.PQ, axes=([0], [0]))
-        p = self.PL - mPQ
-        PW = np.tensordot(p, coef_sparse, axes=([3, 2], [0, 1]))
-        PQW = np.tensordot(self.PQ, coef_sparse, axes=([4, 3], [0, 1]))
+            p = self.PL - (self._PQ_m @ m_partial).reshape(self.PL.shape)
+        # Otherwise reuse p, already computed from the current m
+
+        # Contract with w through matrix-vector products on reshaped
+        # tensors, avoiding the transposed copies made by np.tensordot
+        w = coef_sparse.T.ravel()
+        PW = (p.reshape(r * r, -1) @ w).reshape(r, r)
         A_b = (A - PW) / self.eta
-        PQWT_PW = np.tensordot(PQW, A_b, axes=([2, 1], [0, 1]))
-        if self.accel:
-            m_new = m_partial - self.alpha_m * PQWT_PW
+        if self._PQ_is_zero:
+            # the objective does not depend on m, so m stays where it is
+            m_new = m
+        elif self.accel:
+            PQW = (self._PQ_flat @ w).reshape(r, r * r)
+            m_new = m_partial - self.alpha_m * PQW @ A_b.T.ravel()
+            # Restart heuristic: drop the momentum whenever the new step
+            # reverses direction, (m_new - m) . (m - m_prev) < 0. This is a
+            # direction-reversal test, not the gradient-based restart of
+            # O'Donoghue & Candes
+            if np.dot(m_new - m, m - m_prev) < 0.0:
+                tk_previous = 1
         else:
-            m_new = m_prev - self.alpha_m * PQWT_PW
-        m_current = m_new
-
-        # Update A
-        A_new = self._update_A(A - self.alpha_A * A_b, PW)
-        return m_current, m_new, A_new, tk_previous
-
-    def _solve_nonsparse_relax_and_split(self, H, xTy, P_transpose_A, coef_prev):
+            PQW = (self._PQ_flat @ w).reshape(r, r * r)
+            m_new = m - self.alpha_m * PQW @ A_b.T.ravel()
+
+        # Update A. Only when alpha_A and eta are exactly equal (as floats)
+        # does the prox-gradient step A - alpha_A * (A - PW) / eta land on PW,
+        # which lets _update_A reuse the spectrum of PW
+        step_is_PW = self.alpha_A == self.eta
+        if step_is_PW:
+            A_step = PW
+        else:
+            A_step = A - self.alpha_A * A_b
+        A_new = self._update_A(A_step, PW, step_is_PW=step_is_PW)
+        return m, m_new, A_new, tk_previous, PW
+
+    def _setup_nonsparse_relax_and_split(self, H):
+        # H is symmetric positive definite unless the library is degenerate,
+        # so factor it once and apply its inverse through Cholesky solves,
+        # keeping the pseudoinverse only as a fallback
+        try:
+            H_solve = partial(cho_solve, cho_factor(H))
+        except LinAlgError:
+            H_solve = np.linalg.pinv(H, rcond=1e-15).dot
+        if not self.use_constraints:
+            return H_solve, None, None
+        # H^{-1} C^T and the Schur complement depend only on H, so they are
+        # reused for as long as H is
+        inv1_CT = H_solve(self.constraint_lhs.T)
+        schur = self._constraint_lhs_csr @ inv1_CT
+        return H_solve, inv1_CT, schur
+
+    def _solve_nonsparse_relax_and_split(
+        self, H_factors, xTy, P_transpose_A, coef_prev
+    ):
+        g = xTy + P_transpose_A / self.eta
         if self.use_constraints:
-            coef_sparse = self._update_coef_constraints(
-                H, xTy, P_transpose_A, coef_prev
-            ).reshape(coef_prev.shape)
+            coef_sparse = self._update_coef_constraints(H_factors, g)
         else:
-            cho = cho_factor(H)
-            coef_sparse = cho_solve(cho, xTy + P_transpose_A / self.eta).reshape(
-                coef_prev.shape
-            )
-        return coef_sparse
+            H_solve = H_factors[0]
+            coef_sparse = H_solve(g)
+        return coef_sparse.reshape(coef_prev.shape)
 
     def _solve_direct_cvxpy(self, r, N, x_expanded, y, Pmatrix, coef_prev):
         xi = cp.Variable(N * r)
@@ -478,11 +556,13 @@ class TrappingSR3(SR3):
             return np.zeros(r), coef_sparse  # no optimization over m
         else:
             m_cp = cp.Variable(r)
-            L = np.tensordot(self.PL, coef_sparse, axes=([3, 2], [0, 1]))
-            Q = np.reshape(
-                np.tensordot(self.PQ, coef_sparse, axes=([4, 3], [0, 1])), (r, r * r)
-            )
-            Ls = 0.5 * (L + L.T).flatten()
+            w = coef_sparse.T.ravel()
+            L = (self.PL.reshape(r * r, -1) @ w).reshape(r, r)
+            Q = (self._PQ_flat @ w).reshape(r, r * r)
+            # Symmetrize L in place; it is a fresh array owned by this call
+            L += L.T
+            L *= 0.5
+            Ls = L.ravel()
             cost_m = cp.lambda_max(cp.reshape(Ls - m_cp @ Q, (r, r)))
             prob_m = cp.Problem(cp.Minimize(cost_m))
 
@@ -508,12 +588,17 @@ class TrappingSR3(SR3):
 
         # If PL and PQ are passed, make sure dimensions/symmetries are correct
         self._check_P_matrix(r, n_features, N)
+        self._set_Ptensors(r)
 
         # Set initial coefficients
         if self.use_constraints and self.constraint_order.lower() == "target":
             self.constraint_lhs = reorder_constraints(
                 self.constraint_lhs, n_features, output_order="target"
             )
+        if self.use_constraints:
+            # Each constraint involves only a few coefficients, so keep a
+            # sparse copy for the products with the dense H^{-1} solves
+            self._constraint_lhs_csr = sparse.csr_matrix(self.constraint_lhs)
         print(self.coef_)
         coef_sparse = self.coef_.T
 
@@ -521,10 +606,17 @@ class TrappingSR3(SR3):
         row = ["Iteration", "Data Error", "Stability Error", "L1 Error"]
         print("{: >10} | {: >10} | {: >10} | {: >10}".format(*row))
 
+        # Start the histories afresh so that refitting does not keep
+        # appending to the results of previous fits
+        self.A_history_ = []
+        self.m_history_ = []
+        self.PW_history_ = []
+        self.PWeigs_history_ = []
+
         # initial A
         if self.A0 is not None:
             A = self.A0
-        elif np.any(self.PQ != 0.0):
+        elif not self._PQ_is_zero:
             A = np.diag(self.gamma * np.ones(r))
         else:
             A = np.diag(np.zeros(r))
@@ -538,13 +630,27 @@ class TrappingSR3(SR3):
             m = (np.random.rand(r) - np.ones(r)) * 2
         self.m_history_.append(m)
 
-        # Precompute some objects for optimization
-        x_expanded = np.zeros((n_samples, r, n_features, r))
-        for i in range(r):
-            x_expanded[:, i, :, i] = x
-        x_expanded = np.reshape(x_expanded, (n_samples * r, r * n_features))
-        xTx = np.dot(x_expanded.T, x_expanded)
-        xTy = np.dot(x_expanded.T, y.flatten())
+        # Precompute some objects for optimization. x_expanded acts on the
+        # flattened coefficients, one copy of x per target, so it is stored
+        # as the sparse Kronecker product kron(x, I_r).
+        x_expanded = sparse.kron(x, sparse.eye(r), format="csr")
+        xTx = np.kron(np.dot(x.T, x), np.eye(r))
+        xTy = np.dot(x.T, y).flatten()
+
+        # Without PQ, P does not depend on m, so neither does the Hessian
+        # of the unregularized w subproblem and it only needs to be built
+        # and factored once
+        H_factors = None
+
+        if self.evolve_w and self.relax_optim and self.threshold > 0.0:
+            prob_xi = self._setup_sparse_relax_and_split(r, n_features, x_expanded, y)
+
+        # P is rebuilt from m every iteration. Write it into one preallocated
+        # buffer so that Pmatrix is always a view rather than a new array.
+        # Without PQ it is just PL and is filled once here.
+        p = np.array(self.PL, dtype=float)
+        p_flat = p.reshape(-1)
+        Pmatrix = p.reshape(r * r, r * n_features)
 
         # if using acceleration
         tk_prev = 1
@@ -555,9 +661,8 @@ class TrappingSR3(SR3):
         for k in range(self.max_iter):
 
             # update P tensor from the newest m
-            mPQ = np.tensordot(m, self.PQ, axes=([0], [0]))
-            p = self.PL - mPQ
-            Pmatrix = p.reshape(r * r, r * n_features)
+            if not self._PQ_is_zero:
+                np.subtract(self.PL.reshape(-1), self._PQ_m @ m, out=p_flat)
 
             # update w
             coef_prev = coef_sparse
@@ -565,15 +670,17 @@ class TrappingSR3(SR3):
                 if self.relax_optim:
                     if self.threshold > 0.0:
                         coef_sparse = self._solve_sparse_relax_and_split(
-                            r, n_features, x_expanded, y, Pmatrix, A, coef_prev
+                            prob_xi, m, A, coef_prev
                         )
                         print(coef_sparse)
                     else:
-                        pTp = np.dot(Pmatrix.T, Pmatrix)
-                        H = xTx + pTp / self.eta
+                        if H_factors is None or not self._PQ_is_zero:
+                            pTp = np.dot(Pmatrix.T, Pmatrix)
+                            H = xTx + pTp / self.eta
+                            H_factors = self._setup_nonsparse_relax_and_split(H)
                         P_transpose_A = np.dot(Pmatrix.T, A.flatten())
                         coef_sparse = self._solve_nonsparse_relax_and_split(
-                            H, xTy, P_transpose_A, coef_prev
+                            H_factors, xTy, P_transpose_A, coef_prev
                         )
                 else:
                     m, coef_sparse = self._solve_direct_cvxpy(
@@ -585,9 +692,13 @@ class TrappingSR3(SR3):
                 coef_sparse = coef_prev
                 break
 
+            # The P contractions, the history and coef_ all read coef_sparse
+            # transposed, so keep it in Fortran order to make those views
+            coef_sparse = np.asfortranarray(coef_sparse)
+
             if self.relax_optim:
-                m_prev, m, A, tk_prev = self._solve_m_relax_and_split(
-                    r, n_features, m_prev, m, A, coef_sparse, tk_prev
+                m_prev, m, A, tk_prev, PW = self._solve_m_relax_and_split(
+                    r, n_features, m_prev, m, A, coef_sparse, p, tk_prev
                 )
 
             # If problem over m becomes infeasible, break out of the loop
@@ -595,14 +706,18 @@ class TrappingSR3(SR3):
                 m = m_prev
                 break
             self.history_.append(coef_sparse.T)
-            PW = np.tensordot(p, coef_sparse, axes=([3, 2], [0, 1]))
+            # The m update already contracted this iteration's P with the new
+            # coefficients, unless it used an extrapolated m instead
+            if not self.relax_optim or (self.accel and not self._PQ_is_zero):
+                PW = (Pmatrix @ coef_sparse.T.ravel()).reshape(r, r)
 
             # (m,A) update finished, append the result
             self.m_history_.append(m)
             self.A_history_.append(A)
-            eigvals, eigvecs = np.linalg.eig(PW)
             self.PW_history_.append(PW)
-            self.PWeigs_history_.append(np.sort(eigvals))
+            # P is symmetric in its first two indices, so PW is symmetric and
+            # eigvalsh returns its (real, ascending) spectrum directly
+            self.PWeigs_history_.append(np.linalg.eigvalsh(PW))
 
             # update objective
             objective_history.append(self._objective(x, y, coef_sparse, A, PW, k))
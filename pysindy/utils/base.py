@@ -102,20 +102,19 @@ def drop_nan_rows(x, x_dot):
 
 def reorder_constraints(c, n_features, output_order="row"):
     """Reorder constraint matrix."""
-    ret = c.copy()
-
-    if ret.ndim == 1:
-        ret = ret.reshape(1, -1)
-
-    n_targets = ret.shape[1] // n_features
-    shape = (n_targets, n_features)
+    if c.ndim == 1:
+        c = c.reshape(1, -1)
 
+    n_targets = c.shape[1] // n_features
     if output_order == "row":
-        for i in range(ret.shape[0]):
-            ret[i] = ret[i].reshape(shape).flatten(order="F")
+        shape = (n_targets, n_features)
     else:
-        for i in range(ret.shape[0]):
-            ret[i] = ret[i].reshape(shape, order="F").flatten()
+        shape = (n_features, n_targets)
+
+    # Each row is a flattened 2D block; swap its two axes for every row at
+    # once, writing straight into the output
+    ret = np.empty_like(c)
+    ret.reshape(-1, shape[1], shape[0])[:] = c.reshape(-1, *shape).transpose(0, 2, 1)
 
     return ret
 
@@ -215,6 +215,74 @@ def test_trapping_quadratic_library(params):
     check_is_fitted(model)
 
 
+def test_trapping_refit_resets_history():
+    x = np.random.standard_normal((10, 3))
+    opt = TrappingSR3(max_iter=5)
+    model = SINDy(optimizer=opt, feature_library=PolynomialLibrary(include_bias=False))
+    model.fit(x)
+    n_iters = len(opt.PW_history_)
+    model.fit(x)
+    assert len(opt.PW_history_) == n_iters
+    assert len(opt.PWeigs_history_) == n_iters
+    assert len(opt.m_history_) == n_iters + 1
+    assert len(opt.A_history_) == n_iters + 1
+
+
+def test_trapping_accel():
+    np.random.seed(1)
+    x = np.random.standard_normal((10, 3))
+    params = dict(
+        threshold=0.0,
+        PL=np.ones((3, 3, 3, 9)),
+        PQ=np.ones((3, 3, 3, 3, 9)),
+        max_iter=5,
+        tol_m=1e-300,
+    )
+    library = PolynomialLibrary(include_bias=False)
+    opt = TrappingSR3(**params)
+    SINDy(optimizer=opt, feature_library=library).fit(x)
+    opt_accel = TrappingSR3(accel=True, **params)
+    SINDy(optimizer=opt_accel, feature_library=library).fit(x)
+
+    # There is no momentum on the first step, only afterwards
+    np.testing.assert_allclose(opt_accel.m_history_[1], opt.m_history_[1])
+    assert not np.allclose(opt_accel.m_history_[2], opt.m_history_[2])
+
+
+def test_trapping_accel_restart():
+    np.random.seed(1)
+    x = np.random.standard_normal((10, 3))
+    opt = TrappingSR3(
+        threshold=0.0,
+        PL=np.ones((3, 3, 3, 9)),
+        PQ=np.ones((3, 3, 3, 3, 9)),
+        max_iter=1,
+        accel=True,
+    )
+    SINDy(optimizer=opt, feature_library=PolynomialLibrary(include_bias=False)).fit(x)
+    m = opt.m_history_[-1]
+    A = np.zeros((3, 3))
+    coef_sparse = opt.coef_.T
+
+    # Without momentum the step is a plain gradient step
+    _, m_new, _, _, _ = opt._solve_m_relax_and_split(
+        3, 9, m, m, A, coef_sparse, opt.PL, 1
+    )
+    step = m_new - m
+    assert np.any(step != 0)
+
+    # Momentum along the step direction is kept...
+    _, _, _, tk, _ = opt._solve_m_relax_and_split(
+        3, 9, m - 1e-6 * step, m, A, coef_sparse, opt.PL, 5
+    )
+    assert tk > 1
+    # ...but a step that reverses the previous one restarts it
+    _, _, _, tk, _ = opt._solve_m_relax_and_split(
+        3, 9, m + 1e-6 * step, m, A, coef_sparse, opt.PL, 5
+    )
+    assert tk == 1
+
+
 @pytest.mark.parametrize(
     "params",
     [dict(PL=np.ones((3, 3, 3, 9)), PQ=np.ones((3, 3, 3, 3, 9)))],
@@ -491,6 +559,37 @@ def test_target_format_constraints(data_linear_combination, optimizer, target_va
     np.testing.assert_allclose(model.coef_[:, 1], target_value, atol=1e-8)
 
 
+def test_trapping_redundant_constraints(data_linear_combination):
+    x, x_dot = data_linear_combination
+
+    constraint_rhs = 3 * np.ones(3)
+    constraint_lhs = np.zeros((3, x.shape[1] * x_dot.shape[1]))
+
+    # The last constraint repeats the first one
+    constraint_lhs[0, 1] = 1
+    constraint_lhs[1, 4] = 1
+    constraint_lhs[2, 1] = 1
+
+    model = TrappingSR3(
+        threshold=0.0, constraint_lhs=constraint_lhs, constraint_rhs=constraint_rhs
+    )
+    model.fit(x, x_dot)
+    np.testing.assert_allclose(model.coef_[:, 1], 3, atol=1e-8)
+
+
+def test_trapping_objective_history(data_linear_combination):
+    x, x_dot = data_linear_combination
+    opt = TrappingSR3(threshold=0.0, max_iter=5)
+    opt.fit(x, x_dot)
+
+    # the data error must be accurate even when the fit is (nearly) exact
+    data_error = 0.5 * np.sum((x_dot - np.dot(x, opt.coef_.T)) ** 2)
+    trap_error = 0.5 * np.sum((opt.A_history_[-1] - opt.PW_history_[-1]) ** 2)
+    expected = data_error + trap_error / opt.eta
+    assert opt.objective_history[-1] >= 0.0
+    np.testing.assert_allclose(opt.objective_history[-1], expected, rtol=1e-10)
+
+
 @pytest.mark.parametrize("thresholds", [0.005, 0.05])
 @pytest.mark.parametrize("relax_optim", [False, True])
 @pytest.mark.parametrize("noise_levels", [0.0, 0.05, 0.5])